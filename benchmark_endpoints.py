@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Load-test the deployed Modal generation endpoint.
+
+The functional checks live in the pytest suite under tests/.
+"""
+
+import argparse
+import asyncio
+import httpx
+import math
+from pathlib import Path
+import time
+
+# Modal endpoint URLs (update these with your actual URLs)
+ENDPOINTS = {
+    "generate": "https://tranthai0414--musicgen-service-generate.modal.run"
+}
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+async def generate_once(client, semaphore, request_data, index):
+    """Send one generation request and return (latency in seconds, error or None)."""
+    async with semaphore:
+        start_time = time.time()
+        try:
+            response = await client.post(ENDPOINTS["generate"], json=request_data)
+        except httpx.TimeoutException:
+            return time.time() - start_time, "Request timed out (>5 minutes)"
+        except Exception as e:
+            return time.time() - start_time, str(e)
+        latency = time.time() - start_time
+
+    # Successful generations come back as a raw WAV file; any error status or
+    # JSON body is a failure, whether it's our {"error": ...} or FastAPI's
+    # {"detail": ...} validation response
+    is_json = response.headers.get("content-type", "").startswith("application/json")
+    if response.is_error or is_json:
+        body = response.json() if is_json else {}
+        return latency, body.get("error") or body.get("detail") or f"HTTP {response.status_code}"
+    if not response.content:
+        return latency, "No audio data received"
+
+    # Save to file
+    output_file = Path(f"generated_music_{int(time.time())}_{index}.wav")
+    output_file.write_bytes(response.content)
+    print(f"   [{index}] {latency:.1f}s, model {response.headers.get('x-model')}, "
+          f"{len(response.content):,} bytes saved to {output_file}")
+    return latency, None
+
+async def run_benchmark(client, prompt="upbeat electronic music", duration=5.0, num_requests=1, concurrency=1):
+    """Send generation requests, optionally concurrently, and report latency and throughput."""
+    print(f"🎵 Benchmarking music generation...")
+    print(f"   Prompt: '{prompt}'")
+    print(f"   Duration: {duration} seconds")
+    print(f"   Requests: {num_requests} ({concurrency} in flight)")
+    
+    # Prepare request data
+    request_data = {
+        "prompt": prompt,
+        "duration": duration,
+        "temperature": 1.0,
+        "cfg_coef": 3.0,
+        "model_size": "small"  # Use small model for faster testing
+    }
+    
+    print("   Sending requests...")
+    semaphore = asyncio.Semaphore(concurrency)
+    start_time = time.time()
+    results = await asyncio.gather(*(
+        generate_once(client, semaphore, request_data, i) for i in range(num_requests)
+    ))
+    total_time = time.time() - start_time
+    
+    errors = [error for _, error in results if error]
+    for error in errors:
+        print(f"❌ Music generation failed: {error}")
+    
+    latencies = [latency for latency, error in results if not error]
+    if not latencies:
+        return False
+    
+    print(f"✅ {len(latencies)}/{num_requests} generations successful!")
+    print(f"   Latency p50: {_percentile(latencies, 50):.1f}s, p95: {_percentile(latencies, 95):.1f}s")
+    print(f"   Throughput: {len(latencies) / total_time:.2f} generations/s "
+          f"({len(latencies) * duration / total_time:.1f}s of audio per second)")
+    
+    return not errors
+
+async def main(args):
+    """Run the generation benchmark."""
+    print("🎵 Benchmarking Modal MusicGen Service")
+    print("=" * 60)
+    
+    # One pooled client so concurrent requests reuse connections
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:  # 5 minutes timeout
+        return await run_benchmark(
+            client, args.prompt, args.duration, args.requests or args.concurrency, args.concurrency
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the deployed MusicGen generation endpoint")
+    parser.add_argument("--concurrency", "-c", type=int, default=1,
+                        help="Generation requests in flight at once (default: 1)")
+    parser.add_argument("--requests", "-n", type=int, default=None,
+                        help="Total generation requests to send (default: same as --concurrency)")
+    parser.add_argument("--prompt", "-p", type=str, default="happy upbeat electronic dance music",
+                        help="Prompt for the generation requests")
+    parser.add_argument("--duration", "-d", type=float, default=3.0,
+                        help="Duration in seconds (default: 3.0)")
+    success = asyncio.run(main(parser.parse_args()))
+    exit(0 if success else 1)
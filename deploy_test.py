@@ -4,6 +4,7 @@ Simple deployment test for the MusicGen Modal service.
 This script validates that the service can be deployed to Modal.
 """
 
+import re
 import subprocess
 import sys
 from pathlib import Path
@@ -15,20 +16,19 @@ def validate_modal_setup():
         import modal
         print(f"✅ Modal version: {modal.__version__}")
         
-        # Test Modal authentication by trying to list apps
-        result = subprocess.run(
-            ["modal", "app", "list"], 
-            capture_output=True, 
-            text=True
-        )
+        # Test Modal authentication in-process instead of spawning the CLI
+        from modal.client import Client
+        from modal.config import config
         
-        if result.returncode == 0:
-            print("✅ Modal authentication verified")
-            return True
-        else:
+        try:
+            Client.verify(config["server_url"], (config["token_id"], config["token_secret"]))
+        except Exception as e:
             print("❌ Modal authentication failed")
-            print(f"Error: {result.stderr}")
+            print(f"Error: {e}")
             return False
+        
+        print("✅ Modal authentication verified")
+        return True
             
     except ImportError:
         print("❌ Modal not installed")
@@ -49,8 +49,7 @@ def check_service_file():
     
     # Basic syntax check
     try:
-        with open(service_file) as f:
-            content = f.read()
+        content = service_file.read_bytes().decode()
             
         # Check for required components
         checks = [
@@ -60,8 +59,12 @@ def check_service_file():
             ("audiocraft", "AudioCraft import")
         ]
         
+        # Find every required token in a single pass over the file
+        pattern = re.compile("|".join(re.escape(check_str) for check_str, _ in checks))
+        found = set(pattern.findall(content))
+        
         for check_str, description in checks:
-            if check_str in content:
+            if check_str in found:
                 print(f"✅ {description} found")
             else:
                 print(f"⚠️  {description} not found")
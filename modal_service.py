@@ -3,27 +3,40 @@ Simple Modal service for AudioCraft MusicGen music generation.
 This service downloads the MusicGen model and provides endpoints to generate music from text prompts.
 """
 
-import io
+import asyncio
+import glob
+import math
+import mmap
 import os
-from typing import Dict
+import struct
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import modal
+from pydantic import BaseModel, Field
 
 # Create the Modal app
 app = modal.App("musicgen-service")
 
-# Define the Modal image with required dependencies
+# Define the Modal image with required dependencies. Versions are pinned so the
+# layer is cached between deploys and the CUDA build matches the base image.
 image = (
-    modal.Image.debian_slim(python_version="3.11")
-    .pip_install([
-        "torch>=2.0.0",
-        "torchaudio>=2.0.0",
-        "transformers>=4.30.0",
-        "audiocraft",
-        "fastapi>=0.100.0",
-        "boto3>=1.26.0",
-        "pydantic>=2.0.0",
-    ])
+    modal.Image.from_registry("pytorch/pytorch:2.1.0-cuda12.1-cudnn8-runtime")
     .apt_install(["git", "ffmpeg"])
+    .pip_install(
+        [
+            "torch==2.1.0+cu121",
+            "torchaudio==2.1.0+cu121",
+            "transformers==4.36.2",
+            "audiocraft==1.3.0",
+            "fastapi==0.116.1",
+            "orjson==3.11.3",
+            "boto3==1.40.24",
+            "pydantic==2.11.7",
+        ],
+        extra_index_url="https://download.pytorch.org/whl/cu121",
+    )
+    # audiocraft downloads checkpoints here; it lives in the shared volume
+    .env({"AUDIOCRAFT_CACHE_DIR": "/models/musicgen"})
 )
 
 # Define shared volume for model caching
@@ -59,100 +72,402 @@ def list_models():
         ]
     }
 
-@app.function(image=image, gpu="A10G", volumes={"/models": volume}, timeout=600)
-@modal.fastapi_endpoint(method="POST")
-def generate(request_data: Dict):
-    """Generate music endpoint."""
+# Map model sizes to actual model names
+MODEL_MAP = {
+    "small": "facebook/musicgen-small",
+    "medium": "facebook/musicgen-medium", 
+    "large": "facebook/musicgen-large"
+}
+
+# Model weights are cached in the shared volume
+MODEL_CACHE_DIR = "/models/musicgen"
+
+# All sizes stay resident on the A10G (24 GB) so switching model_size is free;
+# large (~6.6 GB in bf16) is only preloaded if it still leaves room for activations
+LARGE_MODEL_BYTES = 7 * 1024**3
+ACTIVATION_HEADROOM_BYTES = 4 * 1024**3
+
+# Micro-batching: prompts queued within one window that share generation
+# settings are decoded together in a single model.generate() call
+BATCH_WINDOW_S = 0.025
+MAX_BATCH_SIZE = 8
+DURATION_BUCKET_S = 5
+MAX_DURATION_S = 30
+
+# EnCodec decode is replayed from CUDA graphs for these batch sizes (smaller
+# batches are padded up) at every duration bucket
+DECODE_GRAPH_BATCH_SIZES = (1, 2, 4, 8)
+
+class GenerateRequest(BaseModel):
+    prompt: str = Field(..., min_length=1, max_length=500)
+    duration: float = Field(default=10.0, gt=0, le=MAX_DURATION_S)
+    temperature: float = Field(default=1.0, gt=0, le=2.0)
+    cfg_coef: float = Field(default=3.0, gt=0, le=10.0)
+    model_size: str = Field(default="small", pattern="^(small|medium|large)$")
+
+def _prefetch_weights(cache_dir: str):
+    """Pull every cached weight file into the page cache in parallel.
+
+    Cold volume reads are sequential inside torch.load; mapping all shards
+    with MAP_POPULATE from a thread pool overlaps them so the subsequent
+    loads hit memory instead of the volume.
+    """
+    files = [
+        path
+        for pattern in ("*.safetensors", "*.bin")
+        for path in glob.glob(os.path.join(cache_dir, "**", pattern), recursive=True)
+    ]
+    if not files:
+        return
+
+    def populate(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size == 0:
+                return
+            flags = mmap.MAP_SHARED | getattr(mmap, "MAP_POPULATE", 0x8000)
+            mm = mmap.mmap(fd, 0, flags=flags, prot=mmap.PROT_READ)
+            mm.close()
+        finally:
+            os.close(fd)
+
+    with ThreadPoolExecutor(max_workers=min(16, len(files))) as pool:
+        list(pool.map(populate, files))
+    print(f"Prefetched {len(files)} weight file(s) from {cache_dir}")
+
+def _to_half_precision(model):
+    """Run the LM in bf16 and the EnCodec decoder in fp16 to halve memory traffic."""
     import torch
-    import torchaudio
-    import base64
-    import io
-    from pydantic import BaseModel, Field
-    from audiocraft.models import MusicGen
-    
-    class GenerateRequest(BaseModel):
-        prompt: str = Field(..., min_length=1, max_length=500)
-        duration: float = Field(default=10.0, gt=0, le=30)
-        temperature: float = Field(default=1.0, gt=0, le=2.0)
-        cfg_coef: float = Field(default=3.0, gt=0, le=10.0)
-        model_size: str = Field(default="small", pattern="^(small|medium|large)$")
-    
-    try:
-        # Validate request
-        req = GenerateRequest(**request_data)
-        
-        print(f"Loading MusicGen model: {req.model_size}")
-        
-        # Map model sizes to actual model names
-        model_map = {
-            "small": "facebook/musicgen-small",
-            "medium": "facebook/musicgen-medium", 
-            "large": "facebook/musicgen-large"
-        }
-        
-        model_name = model_map.get(req.model_size, "facebook/musicgen-small")
-        
-        # Load the model with caching in the volume
-        cache_dir = "/models/musicgen"
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Load model from cache or download
-        model = MusicGen.get_pretrained(model_name, cache_dir=cache_dir)
-        print(f"Successfully loaded {model_name}")
-        
+    from audiocraft.utils.autocast import TorchAutocast
+
+    model.lm.to(dtype=torch.bfloat16)
+    model.compression_model.to(dtype=torch.float16)
+    # MusicGen wraps LM decoding in its own fp16 autocast; match it to the bf16 weights
+    model.autocast = TorchAutocast(enabled=True, device_type="cuda", dtype=torch.bfloat16)
+
+def _compile_lm(model):
+    """Compile the LM forward pass and warm it up so requests don't pay compile time."""
+    import torch
+
+    # LMModel.generate() calls self(...) on the original module, so compile the
+    # bound forward rather than wrapping the module. The streaming KV cache grows
+    # every decode step, so keep automatic dynamic shapes and skip CUDA graphs,
+    # which would be re-recorded for every sequence length.
+    model.lm.forward = torch.compile(model.lm.forward, fullgraph=False)
+
+    model.set_generation_params(duration=2.0)
+    with torch.inference_mode():
+        model.generate(["warmup"], progress=False)
+
+def _capture_decode_graphs(model, pool) -> dict:
+    """Capture the EnCodec decoder as a CUDA graph for each batch size and duration bucket.
+
+    Returns {(batch, frames): (graph, static_latent, static_audio)}. Only the
+    SEANet decoder is captured: the quantizer's decode_latent() copies a host
+    scalar to the GPU, which stream capture doesn't allow, so it stays eager.
+    All graphs draw their scratch memory from one shared pool; they are only
+    ever replayed one at a time, so they can reuse each other's intermediates.
+    """
+    import torch
+
+    compression_model = model.compression_model
+    graphs = {}
+    for duration in range(DURATION_BUCKET_S, MAX_DURATION_S + 1, DURATION_BUCKET_S):
+        frames = int(duration * model.frame_rate)
+        for batch in DECODE_GRAPH_BATCH_SIZES:
+            with torch.inference_mode():
+                codes = torch.zeros(
+                    (batch, compression_model.num_codebooks, frames), dtype=torch.long, device="cuda"
+                )
+                static_latent = compression_model.decode_latent(codes).clone()
+
+                # Warm up on a side stream so cuDNN autotuning isn't captured
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(2):
+                        compression_model.decoder(static_latent)
+                torch.cuda.current_stream().wait_stream(stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph, pool=pool):
+                    static_audio = compression_model.decoder(static_latent)
+            graphs[(batch, frames)] = (graph, static_latent, static_audio)
+    return graphs
+
+def _decode_graph_key(graphs: dict, batch: int, frames: int):
+    """Key of the captured decode graph to replay for a batch, or None to decode eagerly.
+
+    Batches are padded up to the next captured batch size; the frame count
+    must match a captured duration bucket exactly.
+    """
+    padded = next((size for size in DECODE_GRAPH_BATCH_SIZES if size >= batch), None)
+    key = (padded, frames)
+    return key if key in graphs else None
+
+def _wav_bytes(audio, sample_rate: int) -> bytes:
+    """Encode a mono float waveform as a 16-bit PCM WAV file."""
+    import torch
+
+    samples = (audio.clamp(-1, 1) * 32767).to(torch.int16).numpy().tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(samples), b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(samples),
+    )
+    return header + samples
+
+def _bucket_duration(duration: float) -> float:
+    """Round a duration up to the nearest bucket so similar requests can share a batch."""
+    return float(math.ceil(duration / DURATION_BUCKET_S) * DURATION_BUCKET_S)
+
+@app.cls(
+    image=image,
+    gpu="A10G",
+    volumes={"/models": volume},
+    timeout=600,
+    scaledown_window=300,  # Keep the container (and its loaded models) warm between requests
+    min_containers=1,
+)
+@modal.concurrent(max_inputs=16)
+class MusicGenService:
+    """MusicGen models loaded once per container and reused across requests."""
+
+    @modal.enter()
+    def load_models(self):
+        """Load every model size when the container starts."""
+        import torch
+
+        # MusicGen runs fixed shapes, so let cuDNN benchmark its algorithms once
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+        _prefetch_weights(MODEL_CACHE_DIR)
+
+        self.models = {}
+        self._decode_graphs = {}
+        self._graph_pool = torch.cuda.graph_pool_handle()
+        self._get_model("small")
+        self._get_model("medium")
+
+        free_bytes, _ = torch.cuda.mem_get_info()
+        if free_bytes >= LARGE_MODEL_BYTES + ACTIVATION_HEADROOM_BYTES:
+            self._get_model("large")
+        else:
+            print(f"Skipping large model preload: only {free_bytes / 1024**3:.1f} GB free, loading on demand")
+
+        # Pinned host buffer for the longest possible batch, reused for every copy
+        max_samples = self.models["small"].sample_rate * MAX_DURATION_S
+        self._host_buf = torch.empty((MAX_BATCH_SIZE, max_samples), dtype=torch.float32, pin_memory=True)
+
+    @modal.enter()
+    async def start_batcher(self):
+        """Start the background task that drains the request queues in batches."""
+        # One queue per (model_size, duration bucket, temperature, cfg_coef)
+        self._queues = defaultdict(asyncio.Queue)
+        self._batcher = asyncio.create_task(self._run_batcher())
+
+    def _get_model(self, model_size: str):
+        """Return the model for a size, loading it into GPU memory on first use."""
+        from audiocraft.models import MusicGen
+
+        if model_size not in self.models:
+            model_name = MODEL_MAP.get(model_size, "facebook/musicgen-small")
+            print(f"Loading MusicGen model: {model_name}")
+
+            # Load model from the volume cache or download
+            model = MusicGen.get_pretrained(model_name, device="cuda")
+            _to_half_precision(model)
+            _compile_lm(model)
+            try:
+                self._decode_graphs[model_size] = _capture_decode_graphs(model, self._graph_pool)
+            except Exception as e:
+                print(f"CUDA graph capture failed for {model_name}, decoding eagerly: {e}")
+            self.models[model_size] = model
+            print(f"Successfully loaded {model_name}")
+
+        return self.models[model_size]
+
+    async def _run_batcher(self):
+        """Every batch window, run each queue's pending prompts through the model.
+
+        Batches run one at a time, so the GPU and the shared models are only
+        ever touched by a single generate() call.
+        """
+        while True:
+            await asyncio.sleep(BATCH_WINDOW_S)
+            for key, queue in list(self._queues.items()):
+                while not queue.empty():
+                    items = []
+                    while not queue.empty() and len(items) < MAX_BATCH_SIZE:
+                        items.append(queue.get_nowait())
+                    await self._run_batch(key, items)
+
+    async def _run_batch(self, key, items):
+        """Generate one batch off the event loop and resolve each caller's future."""
+        model_size, duration, temperature, cfg_coef = key
+        prompts = [prompt for prompt, _, _ in items]
+        durations = [requested for _, requested, _ in items]
+        try:
+            audio = await asyncio.to_thread(
+                self._generate_batch, model_size, prompts, durations, duration, temperature, cfg_coef
+            )
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, _, future) in enumerate(items):
+            # The caller may have disconnected and cancelled its future
+            if not future.done():
+                future.set_result(audio[i])
+
+    def _decode(self, model_size: str, model, tokens):
+        """Decode LM codes to audio, replaying a captured CUDA graph when one fits."""
+        batch, _, frames = tokens.shape
+        graphs = self._decode_graphs.get(model_size, {})
+        key = _decode_graph_key(graphs, batch, frames)
+        if key is None:
+            print(f"No decode graph for batch {batch} x {frames} frames of {model_size} model, decoding eagerly")
+            return model.compression_model.decode(tokens)
+
+        # Padding rows keep whatever latents the last replay left there; their
+        # output is never read. EncodecModel.decode() would also rescale the
+        # output, but MusicGen always decodes without a scale.
+        graph, static_latent, static_audio = graphs[key]
+        static_latent[:batch].copy_(model.compression_model.decode_latent(tokens))
+        graph.replay()
+        # The static output is overwritten by the next replay; callers copy it
+        # out before then since batches run one at a time
+        return static_audio[:batch]
+
+    def _generate_batch(self, model_size: str, prompts, durations, duration: float, temperature: float, cfg_coef: float):
+        """Decode all prompts of a batch in a single forward pass.
+
+        Returns one WAV file per prompt, trimmed to its requested duration. The
+        samples pass through the shared pinned buffer, so they are encoded here
+        before the next batch can overwrite it.
+        """
+        import torch
+
+        model = self._get_model(model_size)
+
         # Set generation parameters
         model.set_generation_params(
-            duration=req.duration,
-            temperature=req.temperature,
-            cfg_coef=req.cfg_coef
+            duration=duration,
+            temperature=temperature,
+            cfg_coef=cfg_coef
         )
+
+        print(f"Generating batch of {len(prompts)} prompt(s) with {model_size} model")
+        print(f"Duration: {duration}s, Temperature: {temperature}, CFG: {cfg_coef}")
+
+        with torch.inference_mode():
+            # Same steps as model.generate(), with the EnCodec decode swapped for a graph replay
+            attributes, prompt_tokens = model._prepare_tokens_and_attributes(prompts, None)
+            tokens = model._generate_tokens(attributes, prompt_tokens, False)
+            wav = self._decode(model_size, model, tokens)[:, 0].float()  # Drop the channel dimension
+
+            # Trim the bucketed generation back to each requested duration
+            lengths = [int(requested * model.sample_rate) for requested in durations]
+            valid = torch.arange(wav.shape[-1], device=wav.device) < torch.tensor(lengths, device=wav.device)[:, None]
+
+            # Normalize only the clips that would clip, on the GPU before the host copy
+            peak = (wav.abs() * valid).amax(dim=-1, keepdim=True)
+            wav = torch.where(peak > 1.0, wav / peak.clamp_min(1e-8), wav)
+
+            # Asynchronous copy into pinned memory
+            n = max(lengths)
+            audio = self._host_buf[:len(prompts), :n]
+            audio.copy_(wav[:, :n], non_blocking=True)
+
+        # Wait for the copy before the WAV encoder reads the samples
+        torch.cuda.current_stream().synchronize()
+        return [_wav_bytes(audio[i, :length], model.sample_rate) for i, length in enumerate(lengths)]
+
+    async def _generate_audio(self, req: GenerateRequest):
+        """Queue a validated request for batched generation and return its WAV bytes."""
+        print(f"Queueing prompt: '{req.prompt}'")
         
-        print(f"Generating music for prompt: '{req.prompt}'")
-        print(f"Duration: {req.duration}s, Temperature: {req.temperature}, CFG: {req.cfg_coef}")
-        
-        # Generate music
-        with torch.no_grad():
-            wav = model.generate([req.prompt])
-        
-        # Convert tensor to audio bytes
-        audio_tensor = wav[0].squeeze().cpu()  # Remove batch dimension and move to CPU
-        
-        # Normalize audio to prevent clipping
-        if audio_tensor.abs().max() > 0:
-            audio_tensor = audio_tensor / audio_tensor.abs().max()
-        
-        # Convert to bytes using torchaudio
-        buffer = io.BytesIO()
-        torchaudio.save(
-            buffer, 
-            audio_tensor.unsqueeze(0),  # Add channel dimension
-            sample_rate=model.sample_rate,
-            format="wav"
+        # Requests only share a batch when their generation settings match
+        key = (
+            req.model_size,
+            _bucket_duration(req.duration),
+            round(req.temperature, 2),
+            round(req.cfg_coef, 2),
         )
-        
-        audio_bytes = buffer.getvalue()
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[key].put((req.prompt, req.duration, future))
+        audio_bytes = await future
         print(f"Generated audio: {len(audio_bytes)} bytes")
         
-        # Return base64 encoded audio
-        audio_b64 = base64.b64encode(audio_bytes).decode()
+        return audio_bytes
+
+    @modal.fastapi_endpoint(method="POST", label="musicgen-service-generate")
+    async def generate(self, req: GenerateRequest):
+        """Generate music endpoint, returning the raw WAV file as the response body."""
+        from urllib.parse import quote
+        from fastapi.responses import JSONResponse, Response
         
-        return {
-            "success": True,
-            "audio_data": audio_b64,
-            "format": "wav",
-            "duration": req.duration,
-            "prompt": req.prompt,
-            "model": req.model_size
-        }
+        try:
+            audio_bytes = await self._generate_audio(req)
+            
+            return Response(
+                content=audio_bytes,
+                media_type="audio/wav",
+                headers={
+                    "X-Duration": str(req.duration),
+                    # Header values must be latin-1, so percent-encode the prompt
+                    "X-Prompt": quote(req.prompt),
+                    "X-Model": req.model_size,
+                },
+            )
+            
+        except Exception as e:
+            import traceback
+            print(f"Error in generate: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "success": False,
+                    "error": str(e)
+                },
+            )
+
+    @modal.fastapi_endpoint(method="POST", label="musicgen-service-generate-b64")
+    async def generate_b64(self, req: GenerateRequest):
+        """Generate music endpoint returning base64 encoded audio in JSON, for clients that need it."""
+        import base64
+        from fastapi.responses import ORJSONResponse
         
-    except Exception as e:
-        import traceback
-        print(f"Error in generate: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        return {
-            "success": False,
-            "error": str(e)
-        }
+        try:
+            audio_bytes = await self._generate_audio(req)
+            
+            # Return base64 encoded audio
+            audio_b64 = base64.b64encode(audio_bytes).decode()
+            
+            # orjson serializes the multi-megabyte string much faster than the stdlib encoder
+            return ORJSONResponse({
+                "success": True,
+                "audio_data": audio_b64,
+                "format": "wav",
+                "duration": req.duration,
+                "prompt": req.prompt,
+                "model": req.model_size
+            })
+            
+        except Exception as e:
+            import traceback
+            print(f"Error in generate_b64: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
 
 if __name__ == "__main__":
     # For local testing
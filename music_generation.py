@@ -1,9 +1,53 @@
+import os
+import threading
 import modal
 from pydantic import BaseModel
 from typing import Optional, List
 
 app = modal.App("opencut-music-generation")
 
+# Shared volume for model caching, so cold containers don't re-download weights
+volume = modal.Volume.from_name("musicgen-models", create_if_missing=True)
+MODEL_CACHE_DIR = "/models/musicgen"
+
+# Heavy AudioCraft + CUDA image, only used by the generation service. Torch is
+# pinned to the CUDA build matching the base image so the layer caches.
+heavy_image = (
+    modal.Image.from_registry("pytorch/pytorch:2.1.0-cuda12.1-cudnn8-runtime")
+    .apt_install(["ffmpeg", "git"])
+    .pip_install(
+        [
+            "audiocraft==1.3.0",
+            "torch==2.1.0+cu121",
+            "torchaudio==2.1.0+cu121",
+            "transformers==4.36.2",
+            "fastapi[standard]==0.116.1",
+            "pydantic==2.11.7",
+            "boto3==1.40.24",
+        ],
+        extra_index_url="https://download.pytorch.org/whl/cu121",
+    )
+    .env({
+        # Keep MusicGen checkpoints and Hugging Face / Torch hub downloads
+        # (e.g. the T5 text encoder) in the volume
+        "AUDIOCRAFT_CACHE_DIR": MODEL_CACHE_DIR,
+        "HF_HOME": "/models/hf",
+        "HUGGINGFACE_HUB_CACHE": "/models/hf/hub",
+        "TORCH_HOME": "/models/torch",
+    })
+    # Shared helpers live in modal_service.py
+    .add_local_python_source("modal_service")
+)
+
+# Lightweight image for the metadata endpoints, which boots much faster
+light_image = (
+    modal.Image.debian_slim(python_version="3.11")
+    .pip_install([
+        "fastapi[standard]>=0.100.0",
+        "pydantic>=2.0.0"
+    ])
+)
+
 class MusicGenerationRequest(BaseModel):
     prompt: str
     duration: Optional[float] = 10.0  # Duration in seconds (default 10s)
@@ -22,82 +66,141 @@ class MusicGenerationResponse(BaseModel):
     prompt: str
     error: Optional[str] = None
 
-@app.function(
-    image=modal.Image.from_registry("pytorch/pytorch:2.1.0-cuda12.1-cudnn8-runtime")
-        .apt_install(["ffmpeg", "git"])
-        .pip_install([
-            "audiocraft==1.3.0",
-            "torch>=2.1.0",
-            "torchaudio>=2.1.0", 
-            "fastapi[standard]>=0.100.0",
-            "pydantic>=2.0.0",
-            "boto3>=1.26.0",
-            "cryptography>=3.4.8",
-            "librosa>=0.9.0",
-            "numpy",
-            "scipy"
-        ]),
-    gpu=modal.gpu.A10G(),  # AudioCraft requires decent GPU for inference
+# R2 client shared by every request in the container, so TLS and credential
+# setup happen once and uploads reuse pooled keep-alive connections
+_S3 = {}
+_S3_LOCK = threading.Lock()
+
+def get_s3():
+    """Return the cached R2 client, or None if the R2 secrets are not configured."""
+    import boto3
+    from botocore.config import Config
+
+    required = ("CLOUDFLARE_ACCOUNT_ID", "R2_ACCESS_KEY_ID", "R2_SECRET_ACCESS_KEY")
+    if not all(name in os.environ for name in required):
+        return None
+
+    # boto3's default session isn't thread-safe, and requests run concurrently
+    with _S3_LOCK:
+        if "r2" not in _S3:
+            _S3["r2"] = boto3.client(
+                's3',
+                endpoint_url=f'https://{os.environ["CLOUDFLARE_ACCOUNT_ID"]}.r2.cloudflarestorage.com',
+                aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
+                aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
+                region_name='auto',
+                config=Config(
+                    max_pool_connections=32,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                    tcp_keepalive=True,
+                ),
+            )
+        return _S3["r2"]
+
+def _upload_in_background(s3_client, buffer, bucket_name, filename):
+    """Upload the WAV buffer to R2 on a daemon thread so the response doesn't wait on it."""
+    def upload():
+        try:
+            s3_client.upload_fileobj(
+                buffer,
+                bucket_name,
+                filename,
+                ExtraArgs={"ContentType": "audio/wav"}
+            )
+            print(f"Audio uploaded to R2: {filename}")
+        except Exception as upload_error:
+            print(f"Failed to upload to R2: {str(upload_error)}")
+
+    threading.Thread(target=upload, daemon=True).start()
+
+# Map model sizes to actual model names
+MODEL_NAME_MAP = {
+    "small": "facebook/musicgen-small",
+    "medium": "facebook/musicgen-medium", 
+    "large": "facebook/musicgen-large"
+}
+
+@app.cls(
+    image=heavy_image,
+    gpu="A10G",  # AudioCraft requires decent GPU for inference
+    volumes={"/models": volume},
     timeout=600,  # 10 minutes timeout
-    secrets=[modal.Secret.from_name("opencut-r2-secrets")]
+    secrets=[modal.Secret.from_name("opencut-r2-secrets")],
+    scaledown_window=300,  # Keep the container (and its loaded models) warm between requests
+    min_containers=1,
 )
-@modal.fastapi_endpoint(method="POST")
-def generate_music(request: MusicGenerationRequest):
-    import tempfile
-    import os
-    import traceback
-    import torch
-    import torchaudio
-    import boto3
-    from audiocraft.models import MusicGen
-    import time
-    import uuid
-    
-    try:
-        print(f"Starting music generation with prompt: {request.prompt}")
-        print(f"Model size: {request.model_size}, Duration: {request.duration}s")
-        
-        # Load the MusicGen model
-        model_name_map = {
-            "small": "facebook/musicgen-small",
-            "medium": "facebook/musicgen-medium", 
-            "large": "facebook/musicgen-large"
-        }
-        
-        model_name = model_name_map.get(request.model_size, "facebook/musicgen-medium")
-        print(f"Loading model: {model_name}")
-        
-        model = MusicGen.get_pretrained(model_name)
-        
-        # Set generation parameters
-        model.set_generation_params(
-            duration=request.duration,
-            top_k=request.top_k,
-            top_p=request.top_p,
-            temperature=request.temperature,
-            cfg_coeff=request.cfg_coeff,
-        )
-        
-        print("Generating music...")
-        start_time = time.time()
-        
-        # Generate music
-        descriptions = [request.prompt]
-        wav = model.generate(descriptions)  # wav shape: [1, 1, sample_rate * duration]
-        
-        generation_time = time.time() - start_time
-        print(f"Music generated in {generation_time:.2f} seconds")
+@modal.concurrent(max_inputs=4)
+class MusicGenerationService:
+    """MusicGen models loaded once per container and reused across requests."""
+
+    @modal.enter()
+    def load_model(self):
+        """Load the default model when the container starts."""
+        import torch
+
+        # MusicGen runs fixed shapes, so let cuDNN benchmark its algorithms once
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
+
+        self.models = {}
+        # Requests share one model per size; serialize access to its generation params
+        self._lock = threading.Lock()
+        self._get_model("medium")
+
+    def _get_model(self, model_size: str):
+        """Return the model for a size, loading it into GPU memory on first use."""
+        from audiocraft.models import MusicGen
+        from modal_service import _to_half_precision
+
+        if model_size not in self.models:
+            model_name = MODEL_NAME_MAP.get(model_size, "facebook/musicgen-medium")
+            print(f"Loading model: {model_name}")
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            model = MusicGen.get_pretrained(model_name, device="cuda")
+            _to_half_precision(model)
+            self.models[model_size] = model
+
+        return self.models[model_size]
+
+    @modal.fastapi_endpoint(method="POST", label="opencut-music-generation-generate-music")
+    def generate_music(self, request: MusicGenerationRequest):
+        import io
+        from modal_service import _wav_bytes
+        import traceback
+        import torch
+        import time
         
-        # Create temporary file for the generated audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            temp_path = temp_file.name
+        try:
+            print(f"Starting music generation with prompt: {request.prompt}")
+            print(f"Model size: {request.model_size}, Duration: {request.duration}s")
+            
+            with self._lock:
+                model = self._get_model(request.model_size)
+                
+                # Set generation parameters
+                model.set_generation_params(
+                    duration=request.duration,
+                    top_k=request.top_k,
+                    top_p=request.top_p,
+                    temperature=request.temperature,
+                    cfg_coef=request.cfg_coeff,
+                )
+                
+                print("Generating music...")
+                start_time = time.time()
+                
+                # Generate music
+                descriptions = [request.prompt]
+                with torch.inference_mode():
+                    wav = model.generate(descriptions)  # wav shape: [1, 1, sample_rate * duration]
+            
+            generation_time = time.time() - start_time
+            print(f"Music generated in {generation_time:.2f} seconds")
             
-            # Save the generated audio
+            # Keep the generated audio in memory
             # wav is a torch tensor with shape [1, 1, samples]
             sample_rate = model.sample_rate
-            torchaudio.save(temp_path, wav[0].cpu(), sample_rate)
-            
-            print(f"Audio saved to temporary file: {temp_path}")
+            buffer = io.BytesIO(_wav_bytes(wav[0, 0].float().cpu(), sample_rate))
             
             # If output_filename is provided, upload to R2
             audio_url = None
@@ -105,31 +208,25 @@ def generate_music(request: MusicGenerationRequest):
             
             if filename:
                 try:
-                    # Initialize R2 client
-                    s3_client = boto3.client(
-                        's3',
-                        endpoint_url=f'https://{os.environ["CLOUDFLARE_ACCOUNT_ID"]}.r2.cloudflarestorage.com',
-                        aws_access_key_id=os.environ["R2_ACCESS_KEY_ID"],
-                        aws_secret_access_key=os.environ["R2_SECRET_ACCESS_KEY"],
-                        region_name='auto'
-                    )
+                    s3_client = get_s3()
+                    if s3_client is None:
+                        raise RuntimeError("R2 credentials are not configured")
                     
-                    # Upload to R2
+                    # Start the upload and hand back a presigned GET URL right
+                    # away; signing is local, so no round trip to R2 here
                     bucket_name = os.environ["R2_BUCKET_NAME"]
-                    s3_client.upload_file(temp_path, bucket_name, filename)
-                    
-                    # Generate public URL (note: you may need to configure R2 for public access)
-                    audio_url = f"https://{bucket_name}.{os.environ['CLOUDFLARE_ACCOUNT_ID']}.r2.cloudflarestorage.com/{filename}"
-                    print(f"Audio uploaded to R2: {audio_url}")
+                    _upload_in_background(s3_client, buffer, bucket_name, filename)
+                    audio_url = s3_client.generate_presigned_url(
+                        'get_object',
+                        Params={'Bucket': bucket_name, 'Key': filename},
+                        ExpiresIn=3600
+                    )
+                    print(f"Audio upload to R2 started: {filename}")
                     
                 except Exception as upload_error:
-                    print(f"Failed to upload to R2: {str(upload_error)}")
+                    print(f"Failed to start R2 upload: {str(upload_error)}")
                     # Continue without upload - we'll still return the success
             
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-                
             return MusicGenerationResponse(
                 success=True,
                 audio_url=audio_url,
@@ -138,26 +235,19 @@ def generate_music(request: MusicGenerationRequest):
                 prompt=request.prompt
             ).model_dump()
             
-    except Exception as e:
-        error_msg = str(e)
-        print(f"Music generation error: {error_msg}")
-        print(f"Traceback: {traceback.format_exc()}")
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Music generation error: {error_msg}")
+            print(f"Traceback: {traceback.format_exc()}")
         
-        return MusicGenerationResponse(
-            success=False,
-            prompt=request.prompt,
-            error=error_msg
-        ).model_dump()
+            return MusicGenerationResponse(
+                success=False,
+                prompt=request.prompt,
+                error=error_msg
+            ).model_dump()
 
 @app.function(
-    image=modal.Image.from_registry("pytorch/pytorch:2.1.0-cuda12.1-cudnn8-runtime")
-        .apt_install(["ffmpeg"])
-        .pip_install([
-            "audiocraft==1.3.0",
-            "torch>=2.1.0",
-            "fastapi[standard]>=0.100.0",
-            "pydantic>=2.0.0"
-        ]),
+    image=light_image,
     timeout=60
 )
 @modal.fastapi_endpoint(method="GET", path="/health")
@@ -166,11 +256,7 @@ def health_check():
     return {"status": "healthy", "service": "opencut-music-generation"}
 
 @app.function(
-    image=modal.Image.from_registry("pytorch/pytorch:2.1.0-cuda12.1-cudnn8-runtime")
-        .pip_install([
-            "audiocraft==1.3.0",
-            "torch>=2.1.0"
-        ]),
+    image=light_image,
     timeout=120
 )
 @modal.fastapi_endpoint(method="GET", path="/models")
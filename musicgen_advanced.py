@@ -7,10 +7,16 @@ More customizable music generation with different models and parameters
 import torch
 import torchaudio
 from audiocraft.models import MusicGen
+from audiocraft.modules.transformer import set_efficient_attention_backend
+from audiocraft.utils.autocast import TorchAutocast
 import os
+import re
 import argparse
 from datetime import datetime
 
+# Characters allowed in auto-generated filenames
+_SAFE = re.compile(r"[^A-Za-z0-9 _-]")
+
 def main():
     parser = argparse.ArgumentParser(description='Generate music with MusicGen')
     parser.add_argument('--prompt', '-p', type=str, required=True,
@@ -42,9 +48,22 @@ def main():
     print(f"Model: {args.model}")
     print()
     
-    # Check device
-    device = 'mps' if torch.backends.mps.is_available() else 'cpu'
-    print(f"Using device: {device}")
+    # Check device: CUDA first, then Apple MPS, then CPU
+    if torch.cuda.is_available():
+        device = 'cuda'
+    elif torch.backends.mps.is_available():
+        device = 'mps'
+    else:
+        device = 'cpu'
+    dtype = torch.float16 if device != 'cpu' else torch.float32
+    print(f"Using device: {device} ({dtype})")
+
+    # Attention goes through torch's scaled_dot_product_attention; on CUDA let it
+    # pick the flash / memory-efficient kernels, keeping math for masked steps
+    set_efficient_attention_backend('torch')
+    if device == 'cuda':
+        torch.backends.cuda.enable_flash_sdp(True)
+        torch.backends.cuda.enable_mem_efficient_sdp(True)
     
     try:
         # Load the specified model
@@ -52,7 +71,17 @@ def main():
         print(f"📥 Loading model: {model_name}")
         print("(This may take a while for medium/large models)")
         
-        model = MusicGen.get_pretrained(model_name)
+        if device == 'cuda':
+            model = MusicGen.get_pretrained(model_name, device='cuda')
+        else:
+            # Load on CPU and move by hand; audiocraft would otherwise try to
+            # autocast on mps, which torch does not support
+            model = MusicGen.get_pretrained(model_name, device='cpu')
+            if device == 'mps':
+                model.device = torch.device('mps')
+                model.autocast = TorchAutocast(enabled=False)
+        model.lm.to(device=device, dtype=dtype)
+        model.compression_model.to(device=device, dtype=dtype)
         print("✅ Model loaded successfully!")
         
         # Set generation parameters
@@ -79,18 +108,18 @@ def main():
             filename = f"{args.output}/{args.filename}.wav"
         else:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_prompt = "".join(c for c in args.prompt[:30] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            safe_prompt = safe_prompt.replace(' ', '_')
+            safe_prompt = _SAFE.sub("", args.prompt[:30]).strip().replace(" ", "_")
             filename = f"{args.output}/musicgen_{args.model}_{safe_prompt}_{timestamp}.wav"
         
         print(f"🎵 Generating music...")
         print(f"This will take approximately {args.duration // 5} minutes for {args.duration}s")
         
         # Generate the music
-        wav = model.generate([args.prompt], progress=True)
+        with torch.inference_mode():
+            wav = model.generate([args.prompt], progress=True)
         
         # Save the audio file
-        torchaudio.save(filename, wav[0].cpu(), model.sample_rate)
+        torchaudio.save(filename, wav[0].float().cpu(), model.sample_rate)
         
         print(f"✅ Music generated successfully!")
         print(f"📁 Saved: {filename}")
@@ -3,11 +3,17 @@ Production-ready Modal service for MusicGen using Hugging Face Transformers.
 This approach avoids AudioCraft compatibility issues.
 """
 
+import asyncio
+import hashlib
 import io
-import os
-import base64
+import math
+import struct
+import threading
+from base64 import b64encode
+from collections import OrderedDict
 from typing import Dict
 import modal
+from pydantic import BaseModel, Field
 
 app = modal.App("musicgen-production")
 
@@ -16,15 +22,34 @@ image = (
     modal.Image.debian_slim(python_version="3.10")
     .pip_install([
         "torch>=2.0.0",
-        "torchaudio>=2.0.0",
-        "transformers>=4.30.0", 
+        # Pinned: the service feeds generate() its own encoder outputs, which
+        # relies on release-specific handling inside generate()
+        "transformers==4.57.1", 
+        "accelerate>=0.26.0",
         "scipy>=1.9.0",
+        "soundfile>=0.12.1",
         "fastapi>=0.100.0",
         "pydantic>=2.0.0",
     ])
     .apt_install(["git", "ffmpeg"])
+    # Keep TorchInductor's compiled kernels in the volume so cold containers reuse them
+    .env({
+        "TORCHINDUCTOR_CACHE_DIR": "/models/inductor_cache",
+        "TORCHINDUCTOR_FX_GRAPH_CACHE": "1",
+        # Grow allocator segments in place instead of fragmenting across
+        # differently sized batches and buckets
+        "PYTORCH_CUDA_ALLOC_CONF": "expandable_segments:True",
+    })
 )
 
+# The routing endpoints only need FastAPI, pydantic and orjson
+web_image = modal.Image.debian_slim(python_version="3.10").pip_install([
+    "fastapi>=0.100.0",
+    "pydantic>=2.0.0",
+    "orjson==3.11.3",
+])
+
+# Shared volume for the TorchInductor cache
 volume = modal.Volume.from_name("musicgen-hf-models", create_if_missing=True)
 
 @app.function(image=image)
@@ -60,110 +85,601 @@ def list_models():
         ]
     }
 
-@app.function(image=image, gpu="A10G", volumes={"/models": volume}, timeout=600)
-@modal.fastapi_endpoint(method="POST")
-def generate_music(request_data: Dict):
-    """Generate music using Hugging Face Transformers MusicGen."""
+# Map model sizes to Hugging Face model names
+MODEL_MAP = {
+    "small": "facebook/musicgen-small",
+    "medium": "facebook/musicgen-medium",
+    "large": "facebook/musicgen-large"
+}
+
+def _download_models():
+    """Download every model size and the shared processor at image build time."""
+    from huggingface_hub import snapshot_download
+
+    # Fetch the files into the Hugging Face cache without loading any weights.
+    # The repos also carry audiocraft checkpoints, which transformers never reads.
+    for model_name in MODEL_MAP.values():
+        snapshot_download(
+            model_name,
+            allow_patterns=["*.json", "*.safetensors", "spiece.model"],
+        )
+
+# The GPU service runs from an image with the weights baked in, so cold starts
+# load them from local disk instead of downloading from the Hub or the volume
+model_image = (
+    image
+    .run_function(_download_models)
+    .env({"HF_HUB_OFFLINE": "1"})
+)
+
+# MusicGen generates ~50 tokens per second of audio. Token counts are rounded up
+# to a few fixed lengths, and each (model size, bucket) pair is served by its
+# own service variant
+TOKENS_PER_SECOND = 50
+TOKEN_BUCKETS = (256, 512, 768, 1024, 1280, 1536)
+
+# Every MusicGen size decodes through the same 32 kHz EnCodec
+SAMPLE_RATE = 32000
+
+# Micro-batching: prompts queued within one window are generated together in a
+# single model.generate() call of up to the container's batch size. Streaming
+# generation runs one prompt at a time, in its own batch-size-1 containers, so
+# a long stream never holds up queued batches.
+BATCH_WINDOW_S = 0.02
+MAX_BATCH_SIZE = 8
+STREAM_BATCH_SIZE = 1
+
+# Recently generated WAV files, keyed by request, so repeated prompts skip the
+# decoder loop entirely. Hits return the earlier (sampled) clip.
+RESULT_CACHE_SIZE = 64
+RESULT_CACHE_MAX_AGE_S = 3600
+
+# T5 encoder states of recent prompts, keyed by prompt hash, so a repeated
+# prompt only runs the decoder. Must hold at least one full batch.
+ENCODER_CACHE_SIZE = 256
+
+MAX_DURATION_S = 30
+
+def _bucket_tokens(duration: float) -> int:
+    """Round the token count for a duration up to the nearest bucket."""
+    tokens = int(duration * TOKENS_PER_SECOND)
+    return next((bucket for bucket in TOKEN_BUCKETS if bucket >= tokens), tokens)
+
+def _compile_decoder(model, processor):
+    """Compile the MusicGen decoder and warm it up so requests don't pay compile time."""
     import torch
-    import torchaudio
-    from transformers import MusicgenForConditionalGeneration, AutoProcessor
-    from pydantic import BaseModel, Field
-    
-    class GenerateRequest(BaseModel):
-        prompt: str = Field(..., min_length=1, max_length=500)
-        duration: float = Field(default=10.0, gt=0, le=30)
-        model_size: str = Field(default="small", pattern="^(small|medium|large)$")
-    
-    try:
-        # Validate request
-        req = GenerateRequest(**request_data)
-        
-        # Map model sizes to Hugging Face model names
-        model_map = {
-            "small": "facebook/musicgen-small",
-            "medium": "facebook/musicgen-medium",
-            "large": "facebook/musicgen-large"
-        }
-        
-        model_name = model_map[req.model_size]
-        cache_dir = "/models/musicgen-hf"
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        print(f"Loading model: {model_name}")
-        
-        # Load model and processor
-        processor = AutoProcessor.from_pretrained(model_name, cache_dir=cache_dir)
-        model = MusicgenForConditionalGeneration.from_pretrained(
-            model_name, 
-            cache_dir=cache_dir,
-            torch_dtype=torch.float16,
-            device_map="auto"
+
+    # generate() runs the T5 encoder once but the decoder once per token, so the
+    # decoder is the hot path. MusicGen's generate() never builds a static KV
+    # cache, so the cache gains a position every step: automatic dynamic shapes
+    # give one length-generic graph, whereas mode="reduce-overhead" would
+    # record a new CUDA graph per length.
+    model.decoder.forward = torch.compile(model.decoder.forward, fullgraph=False)
+
+    # Warm up with two batches of different sizes and prompt lengths, so the
+    # batch and text dimensions are marked dynamic here rather than
+    # recompiled on the first real multi-prompt batch
+    warmup_prompts = ["warmup", "a slightly longer warmup prompt"]
+    with torch.inference_mode():
+        for batch_size in (1, 2):
+            inputs = processor(text=warmup_prompts[:batch_size], padding=True, return_tensors="pt").to("cuda")
+            model.generate(**inputs, max_new_tokens=16, do_sample=True, guidance_scale=3.0)
+
+def _wav_header(num_samples: int, sample_rate: int) -> bytes:
+    """Header of a mono 16-bit PCM WAV file holding num_samples samples."""
+    data_size = num_samples * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+class _StreamCancelled(Exception):
+    """Raised from the streamer to abort generate() once the client no longer needs audio."""
+
+class AudioStreamer:
+    """Streamer for MusicgenForConditionalGeneration.generate() that emits audio as it is decoded.
+
+    generate() calls put() with each step's codebook tokens. Every play_steps
+    tokens the codes so far are run through the EnCodec decoder, and the new
+    audio is handed to on_audio as 16-bit PCM bytes. Only batch size 1 is
+    supported.
+    """
+
+    def __init__(self, model, on_audio, stop: threading.Event, play_steps: int = TOKENS_PER_SECOND):
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.on_audio = on_audio
+        self.stop = stop
+        self.play_steps = play_steps
+        # The last frames of each decode still change once later tokens arrive,
+        # so hold them back until the next chunk
+        hop_length = math.prod(self.audio_encoder.config.upsampling_ratios)
+        self.stride = hop_length * (play_steps - self.decoder.num_codebooks) // 6
+        self.token_cache = None
+        self.emitted = 0
+
+    def _decode(self):
+        """Decode every token generated so far into a waveform on the GPU."""
+        # Undo the codebook delay pattern, as generate() does for its final output
+        _, pattern_mask = self.decoder.build_delay_pattern_mask(
+            self.token_cache[:, :1],
+            pad_token_id=self.generation_config.decoder_start_token_id,
+            max_length=self.token_cache.shape[-1],
         )
-        
-        print("Model loaded successfully")
-        
-        # Process inputs
-        inputs = processor(
-            text=[req.prompt],
+        codes = self.decoder.apply_delay_pattern_mask(self.token_cache, pattern_mask)
+        codes = codes[codes != self.generation_config.pad_token_id].reshape(1, 1, self.decoder.num_codebooks, -1)
+        output = self.audio_encoder.decode(codes.to(self.audio_encoder.device), audio_scales=[None])
+        return output.audio_values[0, 0]
+
+    def _emit(self, end=None):
+        """Send the decoded audio from the last emitted sample up to end as 16-bit PCM."""
+        import torch
+
+        audio = self._decode()
+        end = len(audio) if end is None else len(audio) + end
+        if end > self.emitted:
+            pcm = (audio[self.emitted:end].float().clamp(-1, 1) * 32767).to(torch.int16)
+            self.on_audio(pcm.cpu().numpy().tobytes())
+            self.emitted = end
+
+    def put(self, value):
+        import torch
+
+        if self.stop.is_set():
+            raise _StreamCancelled()
+        if value.shape[0] > self.decoder.num_codebooks:
+            raise ValueError("AudioStreamer only supports batch size 1")
+
+        # The first call carries the decoder start tokens, later calls one token per codebook
+        if self.token_cache is None:
+            self.token_cache = value
+        else:
+            self.token_cache = torch.cat([self.token_cache, value[:, None]], dim=-1)
+
+        if self.token_cache.shape[-1] % self.play_steps == 0:
+            self._emit(end=-self.stride)
+
+    def end(self):
+        if self.token_cache is not None:
+            self._emit()
+
+class GenerateRequest(BaseModel):
+    prompt: str = Field(..., min_length=1, max_length=500)
+    duration: float = Field(default=10.0, gt=0, le=MAX_DURATION_S)
+    model_size: str = Field(default="small", pattern="^(small|medium|large)$")
+
+@app.cls(
+    image=model_image,
+    gpu="A10G",
+    volumes={"/models": volume},
+    timeout=600,
+    scaledown_window=300,  # Keep the container (and its loaded model) warm between requests
+)
+@modal.concurrent(max_inputs=MAX_BATCH_SIZE)
+class MusicGenProductionService:
+    """One MusicGen model for one token bucket, loaded once per container.
+
+    Each (model_size, tokens_bucket, batch_size) combination runs in its own
+    pool of containers, so every generate() call in a container has the same
+    max_new_tokens. batch_size caps the prompts per micro-batch; batches are
+    not padded up to it.
+    """
+
+    model_size: str = modal.parameter(default="small")
+    tokens_bucket: int = modal.parameter(default=512)
+    batch_size: int = modal.parameter(default=MAX_BATCH_SIZE)
+
+    @modal.enter()
+    def load_models(self):
+        """Load the processor and this container's model, and compile its decoder."""
+        import torch
+        from transformers import AutoProcessor, MusicgenForConditionalGeneration
+
+        # Let any remaining fp32 matmuls use TF32 tensor cores
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.set_float32_matmul_precision("high")
+
+        # Every model size shares the same T5 tokenizer and EnCodec feature
+        # extractor; the fast (Rust) tokenizer keeps batch tokenization cheap
+        self.processor = AutoProcessor.from_pretrained(MODEL_MAP["small"], use_fast=True)
+        self._results = OrderedDict()
+        self._enc_cache = OrderedDict()
+
+        model_name = MODEL_MAP[self.model_size]
+        print(f"Loading model: {model_name} ({self.tokens_bucket} tokens, batch size {self.batch_size})")
+
+        # bf16 has fp32's range, so long generations don't overflow the
+        # attention scores the way fp16 can. Weights are loaded straight
+        # into their tensors (no random init, no second host copy) and then
+        # placed on the single GPU explicitly, so no accelerate dispatch
+        # hooks wrap the modules.
+        load_kwargs = {"torch_dtype": torch.bfloat16, "low_cpu_mem_usage": True}
+
+        # SDPA runs attention through torch's fused flash / memory-efficient
+        # kernels; transformers releases without SDPA support for MusicGen
+        # keep the eager path.
+        try:
+            model = MusicgenForConditionalGeneration.from_pretrained(
+                model_name, attn_implementation="sdpa", **load_kwargs
+            )
+        except (ValueError, TypeError) as e:
+            print(f"SDPA attention unavailable, using the default: {e}")
+            model = MusicgenForConditionalGeneration.from_pretrained(model_name, **load_kwargs)
+        self.model = model.to("cuda").eval()
+
+        _compile_decoder(self.model, self.processor)
+        print(f"Model loaded successfully: {model_name}")
+
+        # Persist the compiled kernels for the next cold start
+        volume.commit()
+
+        # int16 output buffers for a full batch of the longest clips, on the
+        # GPU and pinned on the host, reused by every batch
+        max_samples = self.processor.feature_extractor.sampling_rate * MAX_DURATION_S
+        self._pcm_buf = torch.empty((self.batch_size, 1, max_samples), dtype=torch.int16, device="cuda")
+        self._host_buf = torch.empty((self.batch_size, 1, max_samples), dtype=torch.int16, pin_memory=True)
+
+    @modal.enter()
+    async def start_batcher(self):
+        """Start the background task that drains the request queue in batches."""
+        # Every request in this container shares the model and token bucket
+        self._queue = asyncio.Queue()
+        # Held by each batch and streaming generation while it uses the GPU
+        self._gpu_lock = asyncio.Lock()
+        self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def _run_batcher(self):
+        """Every batch window, run the pending prompts through the model.
+
+        Batches and streaming generations run one at a time, so the GPU and the
+        shared model are only ever touched by a single generate() call.
+        """
+        while True:
+            await asyncio.sleep(BATCH_WINDOW_S)
+            while not self._queue.empty():
+                items = []
+                while not self._queue.empty() and len(items) < self.batch_size:
+                    items.append(self._queue.get_nowait())
+                await self._run_batch(items)
+
+    async def _run_batch(self, items):
+        """Generate one batch off the event loop and resolve each caller's future."""
+        prompts = [prompt for prompt, _, _ in items]
+        durations = [duration for _, duration, _ in items]
+        try:
+            async with self._gpu_lock:
+                audio = await asyncio.to_thread(self._generate_batch, prompts, durations)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, _, future) in enumerate(items):
+            # The caller may have disconnected and cancelled its future
+            if not future.done():
+                future.set_result(audio[i])
+
+    def _with_encoder_outputs(self, prompts, inputs, token_lengths):
+        """Add the prompts' T5 encoder states to the tokenized inputs for generate().
+
+        States are cached per prompt without padding, so a repeated prompt
+        skips the text encoder and only new prompts are encoded, in one call.
+        Callers hold the GPU lock, which also guards the cache.
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        keys = [hashlib.sha1(prompt.encode()).hexdigest() for prompt in prompts]
+        states = {}
+        for key in keys:
+            if key in self._enc_cache:
+                self._enc_cache.move_to_end(key)
+                states[key] = self._enc_cache[key]
+
+        missing = {key: i for i, key in enumerate(keys) if key not in states}
+        if missing:
+            rows = torch.tensor(list(missing.values()), device="cuda")
+            with torch.inference_mode():
+                hidden = self.model.get_text_encoder()(
+                    input_ids=inputs["input_ids"][rows],
+                    attention_mask=inputs["attention_mask"][rows],
+                ).last_hidden_state
+            for row, (key, i) in enumerate(missing.items()):
+                # Copy, so the cache doesn't keep the whole batch alive
+                states[key] = self._enc_cache[key] = hidden[row, :token_lengths[i]].clone()
+            while len(self._enc_cache) > ENCODER_CACHE_SIZE:
+                self._enc_cache.popitem(last=False)
+
+        # Re-pad to the tokenizer's length; the attention mask hides the padding
+        attention_mask = inputs["attention_mask"]
+        first = states[keys[0]]
+        with torch.inference_mode():
+            hidden = first.new_zeros((len(keys), attention_mask.shape[1], first.shape[-1]))
+            for i, key in enumerate(keys):
+                hidden[i, :token_lengths[i]] = states[key]
+
+            # generate() only adds the classifier-free guidance null condition
+            # (zero states, fully masked) when it runs the encoder itself
+            hidden = torch.cat([hidden, torch.zeros_like(hidden)])
+            attention_mask = torch.cat([attention_mask, torch.zeros_like(attention_mask)])
+
+        return {
+            "input_ids": inputs["input_ids"],
+            "attention_mask": attention_mask,
+            "encoder_outputs": BaseModelOutput(last_hidden_state=hidden),
+        }
+
+    def _generate_batch(self, prompts, durations):
+        """Generate all prompts of a batch in one generate() call and return one WAV file per prompt."""
+        import torch
+        import soundfile as sf
+
+        # The T5 tokenizer pads on the right and the attention mask hides the padding
+        inputs = self.processor(
+            text=prompts,
             padding=True,
             return_tensors="pt",
         )
-        
-        # Calculate the number of tokens for the duration
-        # MusicGen typically generates ~50 tokens per second
-        max_new_tokens = int(req.duration * 50)
-        
-        print(f"Generating {req.duration}s of audio ({max_new_tokens} tokens)")
-        
+
+        token_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+
+        # Copy from pinned memory so the upload is queued without blocking the host
+        copy_start = torch.cuda.Event(enable_timing=True)
+        copy_end = torch.cuda.Event(enable_timing=True)
+        copy_start.record()
+        inputs = {name: tensor.pin_memory().to("cuda", non_blocking=True) for name, tensor in inputs.items()}
+        copy_end.record()
+        inputs = self._with_encoder_outputs(prompts, inputs, token_lengths)
+
+        print(f"Generating batch of {len(prompts)} prompt(s) with {self.model_size} model ({self.tokens_bucket} tokens)")
+
         # Generate audio
-        with torch.no_grad():
-            audio_values = model.generate(
+        with torch.inference_mode():
+            audio_values = self.model.generate(
                 **inputs,
-                max_new_tokens=max_new_tokens,
+                max_new_tokens=self.tokens_bucket,
                 do_sample=True,
                 guidance_scale=3.0,
             )
-        
-        # Convert to audio
-        audio_data = audio_values[0].cpu().float()
-        sample_rate = model.config.audio_encoder.sampling_rate
-        
-        print(f"Generated audio shape: {audio_data.shape}, sample rate: {sample_rate}")
-        
-        # Normalize audio
-        if audio_data.abs().max() > 0:
-            audio_data = audio_data / audio_data.abs().max()
-        
-        # Convert to bytes
-        buffer = io.BytesIO()
-        torchaudio.save(
-            buffer,
-            audio_data.unsqueeze(0),
-            sample_rate=sample_rate,
-            format="wav"
+
+        # generate() has synchronized by now, so reading the events doesn't stall
+        print(f"Input copy took {copy_start.elapsed_time(copy_end):.3f} ms")
+
+        sample_rate = self.model.config.audio_encoder.sampling_rate
+
+        # Trim, peak-normalize and convert to int16 on the GPU for the whole
+        # batch, so only 2 bytes per sample cross to the host
+        lengths = [min(int(duration * sample_rate), audio_values.shape[-1]) for duration in durations]
+        with torch.inference_mode():
+            audio = audio_values[:, :, :max(lengths)].float()
+            valid = torch.arange(audio.shape[-1], device=audio.device) < torch.tensor(lengths, device=audio.device)[:, None, None]
+            peak = (audio.abs() * valid).amax(dim=(1, 2), keepdim=True).clamp_min(1e-8)
+
+            # Convert into the preallocated buffers; batches hold the GPU lock,
+            # so nothing else touches them until the WAVs below are written
+            pcm = self._pcm_buf[:len(prompts), :, :audio.shape[-1]]
+            pcm.copy_((audio / peak).clamp_(-1, 1).mul_(32767))
+            host = self._host_buf[:len(prompts), :, :audio.shape[-1]]
+            host.copy_(pcm, non_blocking=True)
+
+        # Wait for the copy before soundfile reads the samples
+        torch.cuda.current_stream().synchronize()
+        audio_i16 = host.numpy()
+
+        results = []
+        for i, length in enumerate(lengths):
+            # Write 16-bit PCM directly; soundfile wants [samples, channels]
+            buffer = io.BytesIO()
+            sf.write(buffer, audio_i16[i, :, :length].T, sample_rate, format="WAV", subtype="PCM_16")
+            results.append(buffer.getvalue())
+
+        return results
+
+    def _generate_streaming(self, prompt: str, on_audio, stop: threading.Event):
+        """Generate one prompt, passing each decoded chunk of PCM to on_audio until stop is set."""
+        import torch
+
+        inputs = self.processor(
+            text=[prompt],
+            padding=True,
+            return_tensors="pt",
         )
-        
-        audio_bytes = buffer.getvalue()
-        audio_b64 = base64.b64encode(audio_bytes).decode()
-        
+        token_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        inputs = {name: tensor.pin_memory().to("cuda", non_blocking=True) for name, tensor in inputs.items()}
+        inputs = self._with_encoder_outputs([prompt], inputs, token_lengths)
+
+        try:
+            with torch.inference_mode():
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=self.tokens_bucket,
+                    do_sample=True,
+                    guidance_scale=3.0,
+                    streamer=AudioStreamer(self.model, on_audio, stop),
+                )
+        except _StreamCancelled:
+            pass
+
+    @modal.method()
+    async def stream(self, prompt: str, duration: float):
+        """Generate music and yield the WAV file about one second at a time.
+
+        The audio is clipped rather than peak-normalized, since the peak isn't
+        known until the end. Only served by batch-size-1 containers, which
+        the micro-batched endpoint never routes to.
+        """
+        if self.batch_size != STREAM_BATCH_SIZE:
+            raise ValueError(f"Streaming needs a batch size {STREAM_BATCH_SIZE} container, not {self.batch_size}")
+
+        sample_rate = self.processor.feature_extractor.sampling_rate
+        num_samples = int(duration * sample_rate)
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stop = threading.Event()
+
+        def on_audio(pcm: bytes):
+            loop.call_soon_threadsafe(chunks.put_nowait, pcm)
+
+        # The header declares exactly the requested length
+        yield _wav_header(num_samples, sample_rate)
+        remaining = num_samples * 2
+
+        async with self._gpu_lock:
+            print(f"Streaming {duration}s of audio ({self.tokens_bucket} tokens): '{prompt}'")
+            generation = asyncio.ensure_future(asyncio.to_thread(
+                self._generate_streaming, prompt, on_audio, stop
+            ))
+            generation.add_done_callback(lambda _: chunks.put_nowait(None))
+            try:
+                while remaining > 0:
+                    pcm = await chunks.get()
+                    if pcm is None:
+                        break
+                    pcm = pcm[:remaining]
+                    remaining -= len(pcm)
+                    yield pcm
+
+                # Pad a slightly short generation with silence to match the header
+                if remaining > 0 and generation.done() and generation.exception() is None:
+                    yield bytes(remaining)
+            finally:
+                # Stop generating once the clip is complete or the client has gone
+                stop.set()
+                try:
+                    await generation
+                except Exception as e:
+                    print(f"Error in stream: {e}")
+
+    @modal.method()
+    async def generate(self, prompt: str, duration: float, no_cache: bool = False):
+        """Generate one clip through the micro-batcher and return the WAV file.
+
+        Returns a dict with the WAV bytes, its sample rate and whether it came
+        from the result cache.
+        """
+        # Everything runs on the event loop, so the cache needs no lock
+        cache_key = (prompt, round(duration, 2))
+        audio_bytes = None if no_cache else self._results.get(cache_key)
+        cache_hit = audio_bytes is not None
+
+        if cache_hit:
+            self._results.move_to_end(cache_key)
+            print(f"Cache hit for {duration}s of audio: '{prompt}'")
+        else:
+            print(f"Queueing {duration}s of audio ({self.tokens_bucket} tokens): '{prompt}'")
+
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((prompt, duration, future))
+            audio_bytes = await future
+
+            if not no_cache:
+                self._results[cache_key] = audio_bytes
+                if len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+
         return {
-            "success": True,
-            "audio_data": audio_b64,
-            "format": "wav", 
-            "duration": req.duration,
-            "sample_rate": sample_rate,
-            "prompt": req.prompt,
-            "model": req.model_size
+            "audio": audio_bytes,
+            "sample_rate": self.model.config.audio_encoder.sampling_rate,
+            "cache_hit": cache_hit,
         }
-        
+
+def _service_for(req: GenerateRequest, batch_size: int):
+    """The service variant compiled for this request's model size and token bucket."""
+    return MusicGenProductionService(
+        model_size=req.model_size, tokens_bucket=_bucket_tokens(req.duration), batch_size=batch_size
+    )
+
+# The public endpoints only validate and route, so they run on a small image
+# and leave the GPU containers to the service variants
+@app.function(image=web_image, timeout=600)
+@modal.concurrent(max_inputs=100)
+@modal.fastapi_endpoint(method="POST", label="musicgen-production-generate-stream")
+async def generate_stream(request_data: Dict):
+    """Generate music and stream the WAV file back about one second at a time.
+
+    Playback can start after the first chunk instead of after the whole
+    clip. The audio is clipped rather than peak-normalized, since the peak
+    isn't known until the end.
+    """
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    try:
+        req = GenerateRequest(**request_data)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+    service = _service_for(req, STREAM_BATCH_SIZE)
+
+    async def stream():
+        async for chunk in service.stream.remote_gen.aio(req.prompt, req.duration):
+            yield chunk
+
+    return StreamingResponse(
+        stream(),
+        media_type="audio/wav",
+        headers={
+            "X-Sample-Rate": str(SAMPLE_RATE),
+            "X-Duration": str(req.duration),
+            "X-Model": req.model_size,
+        },
+    )
+
+@app.function(image=web_image, timeout=600)
+@modal.concurrent(max_inputs=100)
+@modal.fastapi_endpoint(method="POST", label="musicgen-production-generate-music")
+async def generate_music(request_data: Dict, base64: bool = False, no_cache: bool = False):
+    """Generate music using Hugging Face Transformers MusicGen.
+
+    Returns the WAV file as the response body, or the previous JSON shape
+    with base64 encoded audio when called with ?base64=1. ?no_cache=1
+    always generates a fresh clip, for benchmarking.
+    """
+    from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+    try:
+        # Validate request
+        req = GenerateRequest(**request_data)
+
+        result = await _service_for(req, MAX_BATCH_SIZE).generate.remote.aio(req.prompt, req.duration, no_cache)
+        audio_bytes = result["audio"]
+
+        if base64:
+            return ORJSONResponse({
+                "success": True,
+                "audio_data": b64encode(audio_bytes).decode(),
+                "format": "wav",
+                "duration": req.duration,
+                "sample_rate": result["sample_rate"],
+                "prompt": req.prompt,
+                "model": req.model_size
+            })
+
+        return Response(
+            content=audio_bytes,
+            media_type="audio/wav",
+            headers={
+                "X-Sample-Rate": str(result["sample_rate"]),
+                "X-Duration": str(req.duration),
+                "X-Model": req.model_size,
+                "X-Cache": "HIT" if result["cache_hit"] else "MISS",
+                "Cache-Control": "no-store" if no_cache else f"max-age={RESULT_CACHE_MAX_AGE_S}",
+            },
+        )
+
     except Exception as e:
         import traceback
         print(f"Error: {e}")
         print(f"Traceback: {traceback.format_exc()}")
-        return {
+        error = {
             "success": False,
             "error": str(e)
         }
+        return error if base64 else JSONResponse(status_code=500, content=error)
 
 if __name__ == "__main__":
     print("MusicGen Production Service (Hugging Face)")
@@ -3,25 +3,13 @@ Simple working Modal service for MusicGen without complex dependencies.
 """
 
 import modal
-import os
+from modal_service import image as audiocraft_image
 
 app = modal.App("simple-musicgen")
 
-# Use a simpler approach with pinned versions that are known to work together
-image = (
-    modal.Image.debian_slim(python_version="3.9")
-    .pip_install([
-        "torch==1.13.1",
-        "torchaudio==0.13.1", 
-        "transformers==4.21.0",
-        "scipy",
-        "librosa",
-        "audiocraft==1.0.0a",  # Use the alpha version which is more stable
-        "fastapi>=0.100.0",
-        "pydantic>=2.0.0",
-    ])
-    .apt_install(["git", "ffmpeg"])
-)
+# Reuse the AudioCraft image from modal_service.py (pinned CUDA 12.1 PyTorch
+# stack) so both apps share one cached image layer
+image = audiocraft_image.add_local_python_source("modal_service")
 
 volume = modal.Volume.from_name("simple-musicgen", create_if_missing=True)
 
@@ -98,14 +86,14 @@ def simple_generation_test():
         print("Loading model...")
         
         # Try to load the smallest model
-        model = MusicGen.get_pretrained('small')
+        model = MusicGen.get_pretrained('facebook/musicgen-small')
         print(f"Model loaded: {type(model)}")
         
         # Very short generation
         model.set_generation_params(duration=2.0)
         
         print("Generating audio...")
-        with torch.no_grad():
+        with torch.inference_mode():
             wav = model.generate(['happy music'])
         
         print(f"Generated tensor shape: {wav.shape}")
@@ -12,4 +12,7 @@ curl -X POST "https://tranthai0414--musicgen-service-generate.modal.run" \
     "model_size": "small"
   }' \
   --max-time 300 \
-  | python -m json.tool
+  --dump-header - \
+  --output generated_music.wav
+
+echo "🎶 Audio saved to generated_music.wav"
@@ -46,20 +46,21 @@ def main():
         output_dir = "generated_music"
         os.makedirs(output_dir, exist_ok=True)
         
-        # Generate music for each description
+        # Generate all clips in one batched call; decoding is bound by loading
+        # the weights each step, so this costs little more than a single clip
         for i, description in enumerate(descriptions, 1):
-            print(f"🎵 Generating clip {i}: '{description}'")
-            
-            # Generate the audio
-            wav = model.generate([description], progress=True)
-            
-            # Create filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            print(f"🎵 Clip {i}: '{description}'")
+        wavs = model.generate(descriptions, progress=True)
+        print()
+        
+        # Create filenames with one shared timestamp
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for i, wav in enumerate(wavs, 1):
             filename = f"{output_dir}/musicgen_test_{i}_{timestamp}.wav"
             
             # Save the audio file
-            # wav is shape (1, 1, sample_rate * duration)
-            torchaudio.save(filename, wav[0].cpu(), model.sample_rate)
+            # wav is shape (1, sample_rate * duration)
+            torchaudio.save(filename, wav.cpu(), model.sample_rate)
             
             print(f"✅ Saved: {filename}")
             print(f"   Duration: {duration}s")
@@ -0,0 +1,100 @@
+"""
+Tests for the AudioCraft MusicGen service in modal_service.py.
+
+The helper tests run offline; the endpoint tests run against an ephemeral
+Modal app.
+"""
+
+import base64
+import io
+import wave
+
+import httpx
+import pytest
+
+from modal_service import (
+    DECODE_GRAPH_BATCH_SIZES,
+    MusicGenService,
+    _bucket_duration,
+    _decode_graph_key,
+    _wav_bytes,
+    app,
+)
+
+@pytest.fixture(scope="module")
+def client():
+    """HTTP client for the endpoints of one ephemeral app shared by the module."""
+    with app.run():
+        with httpx.Client(timeout=600) as client:
+            yield client
+
+def _read_wav(audio_bytes):
+    """Return (sample_rate, frames) of a mono 16-bit WAV file."""
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        assert wav.getnchannels() == 1
+        assert wav.getsampwidth() == 2
+        return wav.getframerate(), wav.getnframes()
+
+@pytest.mark.parametrize("duration,bucket", [
+    (0.5, 5.0),
+    (5.0, 5.0),
+    (5.01, 10.0),
+    (12.0, 15.0),
+    (30.0, 30.0),
+])
+def test_bucket_duration(duration, bucket):
+    assert _bucket_duration(duration) == bucket
+
+def test_wav_bytes_round_trip():
+    torch = pytest.importorskip("torch")
+
+    audio = torch.tensor([0.0, 0.5, -0.5, 2.0, -2.0])
+    audio_bytes = _wav_bytes(audio, 32000)
+
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        assert wav.getframerate() == 32000
+        samples = torch.frombuffer(bytearray(wav.readframes(wav.getnframes())), dtype=torch.int16)
+    # Out-of-range samples are clipped rather than wrapped
+    assert samples.tolist() == [0, 16383, -16383, 32767, -32767]
+
+@pytest.mark.parametrize("batch,frames,expected", [
+    (1, 250, (1, 250)),
+    (3, 250, (4, 250)),
+    (8, 500, (8, 500)),
+    # More prompts than the largest captured batch
+    (9, 250, None),
+    # A frame count that isn't a captured duration bucket
+    (1, 251, None),
+])
+def test_decode_graph_key(batch, frames, expected):
+    graphs = {(size, f): None for size in DECODE_GRAPH_BATCH_SIZES for f in (250, 500)}
+    assert _decode_graph_key(graphs, batch, frames) == expected
+
+def test_decode_graph_key_without_graphs():
+    # Capture failed for this model, so every batch decodes eagerly
+    assert _decode_graph_key({}, 1, 250) is None
+
+def test_generate(client):
+    request_data = {"prompt": "upbeat electronic dance music", "duration": 3.0, "model_size": "small"}
+    response = client.post(MusicGenService().generate.get_web_url(), json=request_data)
+    response.raise_for_status()
+
+    assert response.headers["content-type"] == "audio/wav"
+    sample_rate, frames = _read_wav(response.content)
+    # Generated in the 5 s bucket, then trimmed back to the requested length
+    assert frames == int(3.0 * sample_rate)
+
+def test_generate_b64(client):
+    request_data = {"prompt": "calm acoustic guitar melody", "duration": 2.0, "model_size": "small"}
+    response = client.post(MusicGenService().generate_b64.get_web_url(), json=request_data)
+    response.raise_for_status()
+    result = response.json()
+
+    assert result["success"], result.get("error")
+    sample_rate, frames = _read_wav(base64.b64decode(result["audio_data"]))
+    assert frames == int(2.0 * sample_rate)
+
+def test_generate_rejects_invalid_request(client):
+    request_data = {"prompt": "", "duration": 3.0}
+    response = client.post(MusicGenService().generate.get_web_url(), json=request_data)
+    assert response.status_code == 422
@@ -0,0 +1,130 @@
+"""
+Tests for the MusicGen production service, run against an ephemeral Modal app.
+
+Run with: pytest -n auto
+"""
+
+import base64
+import io
+import wave
+
+import httpx
+import pytest
+
+from production_service import (
+    GenerateRequest,
+    MusicGenProductionService,
+    STREAM_BATCH_SIZE,
+    _bucket_tokens,
+    _wav_header,
+    app,
+    generate_music,
+    health,
+    list_models,
+)
+
+GENERATION_CASES = [
+    ("upbeat electronic dance music", 2.0),
+    ("calm acoustic guitar melody", 3.5),
+    ("epic orchestral soundtrack with drums", 5.0),
+]
+
+@pytest.fixture(scope="module")
+def app_ctx():
+    """One ephemeral app shared by every test in the module (per xdist worker)."""
+    with app.run() as ctx:
+        yield ctx
+
+@pytest.fixture(scope="module")
+def client(app_ctx):
+    """HTTP client for the ephemeral app's endpoints.
+
+    Web endpoints can't be called with .remote(), so they are tested over
+    HTTP at their temporary URLs. Cold containers compile the decoder before
+    answering, hence the long timeout.
+    """
+    with httpx.Client(timeout=600) as client:
+        yield client
+
+def _read_wav(audio_bytes):
+    """Return (sample_rate, frames) of a WAV file."""
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        assert wav.getnchannels() == 1
+        assert wav.getsampwidth() == 2
+        return wav.getframerate(), wav.getnframes()
+
+@pytest.mark.parametrize("request_data", [
+    {"prompt": "", "duration": 5.0},
+    {"prompt": "jazz", "duration": 0},
+    {"prompt": "jazz", "duration": 31.0},
+    {"prompt": "jazz", "model_size": "huge"},
+])
+def test_invalid_request_rejected(request_data):
+    with pytest.raises(ValueError):
+        GenerateRequest(**request_data)
+
+@pytest.mark.parametrize("duration,tokens", [
+    (1.0, 256),
+    (5.12, 256),
+    (5.2, 512),
+    (20.0, 1024),
+    (30.0, 1536),
+])
+def test_bucket_tokens(duration, tokens):
+    assert _bucket_tokens(duration) == tokens
+
+def test_wav_header_round_trip():
+    samples = bytes(range(256)) * 4
+    audio_bytes = _wav_header(len(samples) // 2, 32000) + samples
+
+    sample_rate, frames = _read_wav(audio_bytes)
+    assert sample_rate == 32000
+    assert frames == len(samples) // 2
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        assert wav.readframes(frames) == samples
+
+def test_health(client):
+    response = client.get(health.get_web_url())
+    response.raise_for_status()
+    assert response.json()["status"] == "healthy"
+
+def test_list_models(client):
+    response = client.get(list_models.get_web_url())
+    response.raise_for_status()
+    ids = [model["id"] for model in response.json()["models"]]
+    assert ids == ["small", "medium", "large"]
+
+@pytest.mark.parametrize("prompt,duration", GENERATION_CASES)
+def test_generate_music(client, prompt, duration):
+    request_data = {"prompt": prompt, "duration": duration, "model_size": "small"}
+    response = client.post(generate_music.get_web_url(), params={"no_cache": 1}, json=request_data)
+    response.raise_for_status()
+
+    assert response.headers["content-type"] == "audio/wav"
+    sample_rate, frames = _read_wav(response.content)
+    assert sample_rate == int(response.headers["x-sample-rate"])
+    assert frames == int(duration * sample_rate)
+
+def test_generate_music_base64(client):
+    prompt, duration = GENERATION_CASES[0]
+    request_data = {"prompt": prompt, "duration": duration, "model_size": "small"}
+    response = client.post(generate_music.get_web_url(), params={"base64": 1}, json=request_data)
+    response.raise_for_status()
+    result = response.json()
+
+    assert result["success"], result.get("error")
+    sample_rate, frames = _read_wav(base64.b64decode(result["audio_data"]))
+    assert sample_rate == result["sample_rate"]
+    assert frames == int(duration * sample_rate)
+
+@pytest.mark.parametrize("prompt,duration", GENERATION_CASES[:1])
+def test_stream(app_ctx, prompt, duration):
+    service = MusicGenProductionService(
+        model_size="small", tokens_bucket=_bucket_tokens(duration), batch_size=STREAM_BATCH_SIZE
+    )
+    audio_bytes = b"".join(service.stream.remote_gen(prompt, duration))
+
+    # The header's declared length must match the samples actually sent
+    sample_rate, frames = _read_wav(audio_bytes)
+    assert len(audio_bytes) == 44 + frames * 2
+    assert frames == int(duration * sample_rate)